@@ -15,21 +15,52 @@
 # limitations under the License.
 #
 
+import collections
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import pipes
 import shutil
+import tarfile
 import tempfile
+import time
+import traceback
 
 from vts.runners.host import asserts
 from vts.runners.host import base_test
 from vts.runners.host import const
 from vts.runners.host import keys
 from vts.runners.host import test_runner
+from vts.testcases.vndk.abi import elf_parser_fast
 from vts.testcases.vndk.golden import vndk_data
 from vts.utils.python.controllers import android_device
-from vts.utils.python.library import elf_parser
 from vts.utils.python.library import vtable_parser
 
+try:
+    # scandir.walk doesn't stat every file to separate files from directories.
+    from scandir import walk as _Walk
+except ImportError:
+    _Walk = os.walk
+
+# The suffixes of the dump file names.
+_SYMBOL_DUMP_SUFFIX = "_symbol.dump"
+_VTABLE_DUMP_SUFFIX = "_vtable.dump"
+
+# The buffer size for reading the dump files line by line.
+_DUMP_BUFFER_SIZE = 1 << 16
+
+# The version of the diff results in the cache. Increase it when the format
+# of the results or the comparison changes.
+_DIFF_CACHE_VERSION = 3
+
+# The maximum number of diff results in the cache.
+_DIFF_CACHE_MAX_ENTRIES = 10000
+
+# The VtableParser shared by the tasks in a worker process.
+_worker_vtable_parser = None
+
 
 def _IterateFiles(root_dir):
     """A generator yielding relative and full paths in a directory.
@@ -42,20 +73,324 @@ def _IterateFiles(root_dir):
         relative_path is the relative path to root_dir. full_path is the path
         starting with root_dir.
     """
-    for dir_path, dir_names, file_names in os.walk(root_dir):
-        if dir_path == root_dir:
-            rel_dir = ""
-        else:
-            rel_dir = os.path.relpath(dir_path, root_dir)
+    root_prefix_len = len(os.path.join(root_dir, ""))
+    for dir_path, dir_names, file_names in _Walk(root_dir):
+        # Concatenate strings instead of calling relpath and join per file.
+        rel_dir = os.path.join(dir_path[root_prefix_len:], "")
+        dir_path = os.path.join(dir_path, "")
         for file_name in file_names:
-            yield (os.path.join(rel_dir, file_name),
-                   os.path.join(dir_path, file_name))
+            yield (rel_dir + file_name, dir_path + file_name)
+
+
+def _WriteFileAtomically(path, data):
+    """Writes data to a temporary file and renames it to the path.
+
+    Args:
+        path: The path to the file.
+        data: A string, the data to write.
+
+    Raises:
+        EnvironmentError if fails to write the file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def _DiffSymbols(dump_path, elf):
+    """Checks if a library includes all symbols in a dump.
+
+    Args:
+        dump_path: The path to the dump file containing list of symbols.
+        elf: The elf_parser_fast.ElfParser of the library.
+
+    Returns:
+        A list of strings, the global symbols that are in the dump but not
+        in the library.
+
+    Raises:
+        IOError if fails to load the dump.
+        elf_parser_fast.ElfError if fails to load the symbols.
+    """
+    # Symbol names don't contain white spaces. str.split drops the empty
+    # lines and the line breaks without a Python loop.
+    with open(dump_path, "rb") as dump_file:
+        dump_symbols = frozenset(dump_file.read().split())
+    if not dump_symbols:
+        return []
+    # Only the library symbols in the dump are collected. The library
+    # symbols, which are usually more than the dump, are not put in a list.
+    diff = dump_symbols - elf.MatchGlobalDynamicSymbols(dump_symbols,
+                                                        include_weak=True)
+    return sorted(diff) if diff else []
+
+
+def _ParseVtableDump(parser, dump_file):
+    """Parses vtables from a dump file line by line.
+
+    Unlike VtableParser.ParseVtablesFromString, this function does not read
+    the whole file into a string.
+
+    Args:
+        parser: The vtable_parser.VtableParser.
+        dump_file: The file object of the dump.
+
+    Returns:
+        A dict of {VTABLE: [(OFFSET, SYMBOL), ...]}.
+
+    Raises:
+        vtable_parser.VtableError if fails to parse the dump.
+    """
+    lines = (line.rstrip("\n") for line in dump_file)
+    vtables = dict()
+    try:
+        while True:
+            vtable, entries = parser.ParseOneVtable(lines)
+            vtables[vtable] = entries
+    except StopIteration:
+        pass
+    return vtables
+
+
+def _InvertVtable(entries):
+    """Maps the symbols in a vtable to their offsets.
+
+    Args:
+        entries: A list of (OFFSET, SYMBOL) tuples, the entries of a vtable.
+
+    Returns:
+        A dict of {SYMBOL: [OFFSET, ...]}.
+    """
+    inv_vtable = collections.defaultdict(list)
+    for off, sym in entries:
+        inv_vtable[sym].append(off)
+    return inv_vtable
+
+
+def _DiffVtables(dump_path, lib_path, parser, ignore_empty):
+    """Checks if a library includes all vtable entries in a dump.
+
+    Args:
+        dump_path: The path to the dump file containing vtables.
+        lib_path: The path to the library.
+        parser: The vtable_parser.VtableParser.
+        ignore_empty: A boolean, whether to skip the comparison if no vtable
+                      can be dumped from the library.
+
+    Returns:
+        A list of tuples (VTABLE, SYMBOL, EXPECTED_OFFSET, ACTUAL_OFFSETS).
+        ACTUAL_OFFSETS is a list of the offsets of SYMBOL in the library,
+        or None if the symbol is missing in the library vtable.
+        None if ignore_empty is True and the library has no vtables.
+
+    Raises:
+        IOError if fails to load the dump.
+        vtable_parser.VtableError if fails to parse the dump or load the
+        library.
+    """
+    with open(dump_path, "rb", _DUMP_BUFFER_SIZE) as dump_file:
+        dump_vtables = _ParseVtableDump(parser, dump_file)
+    if not dump_vtables:
+        return []
+
+    lib_vtables = parser.ParseVtablesFromLibrary(lib_path)
+    # TODO(b/78316564): The dumper doesn't support SHT_ANDROID_RELA.
+    if not lib_vtables and ignore_empty:
+        return None
+    lib_inv_vtables = {vtable: _InvertVtable(lib_vtables[vtable])
+                       for vtable in dump_vtables if vtable in lib_vtables}
+    diff = []
+    # Bind the methods called in the inner loop to locals.
+    diff_append = diff.append
+    get_lib_inv_vtable = lib_inv_vtables.get
+    for vtable, dump_symbols in dump_vtables.iteritems():
+        get_lib_offs = get_lib_inv_vtable(vtable, {}).get
+        for off, sym in dump_symbols:
+            lib_offs = get_lib_offs(sym)
+            if lib_offs is None or off not in lib_offs:
+                diff_append((vtable, sym, off, lib_offs))
+    return diff
+
+
+def _FormatVtableDiff(vtable_diff):
+    """Converts the return value of _DiffVtables to a string.
+
+    Args:
+        vtable_diff: A list of (VTABLE, SYMBOL, EXPECTED_OFFSET,
+                     ACTUAL_OFFSETS).
+
+    Returns:
+        A string. Each line consists of the vtable, the symbol, the expected
+        offset, and "missing" or the actual offsets separated by comma.
+    """
+    return "\n".join(
+        "%s %s %s %s" % (vtable, sym, off,
+                         "missing" if lib_offs is None else
+                         ",".join(str(x) for x in lib_offs))
+        for vtable, sym, off, lib_offs in vtable_diff)
+
+
+def _HashFile(path):
+    """Computes the SHA-1 of a file.
+
+    Args:
+        path: The path to the file.
+
+    Returns:
+        A string, the hexadecimal digest.
+
+    Raises:
+        EnvironmentError if fails to read the file.
+    """
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1 << 20), ""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _GetDiffCacheKey(args):
+    """Computes the key of a diff result in the cache in a worker process.
+
+    The key consists of the hashes of the library, the dump files, and the
+    vtable dumper, so that it does not depend on the file timestamps.
+
+    Args:
+        args: A tuple of (task, dumper_hash). task is the argument of
+              _DiffLibrary. dumper_hash is the hash of the vtable dumper.
+
+    Returns:
+        A string, the key.
+        None if fails to read the library or the dumps.
+    """
+    task, dumper_hash = args
+    lib_path, symbol_dump_path, vtable_dump_path, ignore_empty_vtables = task
+    try:
+        file_hashes = [_HashFile(path) if path else None
+                       for path in (lib_path, symbol_dump_path,
+                                    vtable_dump_path)]
+    except EnvironmentError:
+        return None
+    return hashlib.sha1(repr((_DIFF_CACHE_VERSION,
+                              file_hashes,
+                              dumper_hash,
+                              ignore_empty_vtables))).hexdigest()
+
+
+def _IsDiffCacheEntry(entry):
+    """Checks whether an object loaded from the diff cache is valid.
+
+    Args:
+        entry: An object loaded from the JSON file.
+
+    Returns:
+        A boolean, whether the entry is a dict of {"time": float,
+        "result": [missing_symbols, vtable_diff]} as written by
+        _SaveDiffCache.
+    """
+    if not isinstance(entry, dict):
+        return False
+    entry_time = entry.get("time")
+    result = entry.get("result")
+    if (not isinstance(entry_time, (int, float)) or
+            not isinstance(result, list) or len(result) != 2):
+        return False
+    missing_symbols, vtable_diff = result
+    if (not isinstance(missing_symbols, list) or
+            not all(isinstance(x, basestring) for x in missing_symbols)):
+        return False
+    return vtable_diff is None or (
+        isinstance(vtable_diff, list) and
+        all(isinstance(x, list) and len(x) == 4 for x in vtable_diff))
+
+
+def _InitWorker(dumper_dir):
+    """Initializes a worker process for _DiffLibrary.
+
+    Args:
+        dumper_dir: The path to the directory containing the vtable dumper.
+    """
+    global _worker_vtable_parser
+    _worker_vtable_parser = vtable_parser.VtableParser(dumper_dir)
+
+
+def _DiffLibrary(task):
+    """Compares a library with its dump files in a worker process.
+
+    Args:
+        task: A tuple of (lib_path, symbol_dump_path, vtable_dump_path,
+              ignore_empty_vtables). The dump paths can be None.
+
+    Returns:
+        A tuple of (missing_symbols, vtable_diff, errors).
+        missing_symbols is the return value of _DiffSymbols.
+        vtable_diff is the return value of _DiffVtables.
+        errors is a list of strings, the error messages with stack traces.
+    """
+    (lib_path, symbol_dump_path, vtable_dump_path,
+     ignore_empty_vtables) = task
+    missing_symbols = []
+    vtable_diff = []
+    errors = []
+    # Load the library once. If it is not a valid ELF, the vtable dumper
+    # would fail too, so there is no need to run it.
+    try:
+        elf = elf_parser_fast.ElfParser(lib_path)
+    except elf_parser_fast.ElfError:
+        errors.append("Cannot load library\n" + traceback.format_exc())
+        return missing_symbols, vtable_diff, errors
+    try:
+        # Compare symbols
+        if symbol_dump_path:
+            try:
+                missing_symbols = _DiffSymbols(symbol_dump_path, elf)
+            except (IOError, elf_parser_fast.ElfError):
+                errors.append("Cannot diff symbols\n" +
+                              traceback.format_exc())
+        # Compare vtables
+        if vtable_dump_path:
+            try:
+                vtable_diff = _DiffVtables(vtable_dump_path, lib_path,
+                                           _worker_vtable_parser,
+                                           ignore_empty_vtables)
+            except (IOError, vtable_parser.VtableError):
+                errors.append("Cannot diff vtables\n" +
+                              traceback.format_exc())
+    finally:
+        elf.Close()
+    return missing_symbols, vtable_diff, errors
+
+
+def _DiffLibraryInWorker(task):
+    """Calls _DiffLibrary and converts unexpected exceptions to errors.
+
+    An exception raised in a worker process is pickled to the main process.
+    multiprocessing.Pool hangs if the exception cannot be unpickled.
+
+    Args:
+        task: The argument of _DiffLibrary.
+
+    Returns:
+        The return value of _DiffLibrary.
+    """
+    try:
+        return _DiffLibrary(task)
+    except Exception:
+        return [], [], ["Cannot diff library\n" + traceback.format_exc()]
 
 
 class VtsVndkAbiTest(base_test.BaseTestClass):
     """A test module to verify ABI compliance of vendor libraries.
 
     Attributes:
+        _diff_cache: Dict of {key: {"time": float, "result": list}}, the
+                     diff results of the libraries from previous runs.
+                     None if the cache is disabled.
         _dut: the AndroidDevice under test.
         _temp_dir: The temporary directory for libraries copied from device.
         _vndk_version: String, the VNDK version supported by the device.
@@ -67,6 +402,10 @@ class VtsVndkAbiTest(base_test.BaseTestClass):
     _VENDOR_LIB_DIR_64 = "/vendor/lib64"
     _SYSTEM_LIB_DIR_32 = "/system/lib"
     _SYSTEM_LIB_DIR_64 = "/system/lib64"
+    _TAR_LOG_PATH = "/data/local/tmp/VtsVndkAbiTest_tar.log"
+    _USE_DIFF_CACHE_PARAM = "use_diff_cache"
+    _DIFF_CACHE_PATH = os.path.join(tempfile.gettempdir(),
+                                    "VtsVndkAbiTest_diff_cache.json")
 
     def setUpClass(self):
         """Initializes data file path, device, and temporary directory."""
@@ -75,97 +414,176 @@ class VtsVndkAbiTest(base_test.BaseTestClass):
         self._dut = self.android_devices[0]
         self._temp_dir = tempfile.mkdtemp()
         self._vndk_version = self._dut.vndk_version
+        # A compliance test doesn't reuse the results by default.
+        use_diff_cache = self.getUserParam(self._USE_DIFF_CACHE_PARAM,
+                                           default_value=False)
+        self._diff_cache = self._LoadDiffCache() if use_diff_cache else None
 
     def tearDownClass(self):
-        """Deletes the temporary directory."""
+        """Deletes the temporary directory and saves the diff cache."""
         logging.info("Delete %s", self._temp_dir)
         shutil.rmtree(self._temp_dir)
+        if self._diff_cache is not None:
+            self._SaveDiffCache()
 
-    def _PullOrCreateDir(self, target_dir, host_dir):
-        """Copies a directory from device. Creates an empty one if not exist.
+    def _LoadDiffCache(self):
+        """Loads the diff results from previous runs.
+
+        Returns:
+            A dict, the diff cache. Empty if fails to load the cache. The
+            invalid entries are skipped.
+        """
+        try:
+            with open(self._DIFF_CACHE_PATH, "r") as cache_file:
+                cache = json.load(cache_file)
+        except (EnvironmentError, ValueError):
+            return dict()
+        if not isinstance(cache, dict):
+            return dict()
+        return {key: entry for key, entry in cache.iteritems()
+                if _IsDiffCacheEntry(entry)}
+
+    def _SaveDiffCache(self):
+        """Saves the most recently used diff results."""
+        entries = sorted(self._diff_cache.iteritems(),
+                         key=lambda x: x[1]["time"], reverse=True)
+        cache = dict(entries[:_DIFF_CACHE_MAX_ENTRIES])
+        try:
+            _WriteFileAtomically(self._DIFF_CACHE_PATH, json.dumps(cache))
+        except EnvironmentError as e:
+            logging.warning("Cannot save %s: %s", self._DIFF_CACHE_PATH, e)
+
+    def _PullLibDirs(self, dir_pairs):
+        """Copies directories from device. Creates empty ones if not exist.
+
+        The existence of the directories is tested in one shell command, and
+        the existing directories are transferred in one tar stream, so that
+        the number of adb sessions does not depend on the number of
+        directories. If the device cannot create the stream, the directories
+        are pulled one by one.
 
         Args:
-            target_dir: The directory to copy from device.
-            host_dir: The directory to copy to host.
+            dir_pairs: A list of (target_dir, host_dir) tuples. target_dir is
+                       the absolute path to the directory on device. host_dir
+                       is the directory to copy to host.
         """
-        test_cmd = "test -d " + target_dir
+        test_cmd = "for d in %s; do test -d $d && echo 1 || echo 0; done" % (
+            " ".join(target_dir for target_dir, host_dir in dir_pairs))
         logging.info("adb shell %s", test_cmd)
-        result = self._dut.adb.shell(test_cmd, no_except=True)
-        if result[const.EXIT_CODE]:
-            logging.info("%s doesn't exist. Create %s.", target_dir, host_dir)
+        # The proxy runs adb in host shell. Quote the command to run the loop
+        # on device.
+        result = self._dut.adb.shell(pipes.quote(test_cmd), no_except=True)
+        exists = result[const.STDOUT].split()
+        asserts.assertEqual(len(exists), len(dir_pairs),
+                            "Unexpected output: " + result[const.STDOUT])
+
+        pull_pairs = []
+        for (target_dir, host_dir), exist in zip(dir_pairs, exists):
             os.mkdir(host_dir, 0750)
+            if exist != "1":
+                logging.info("%s doesn't exist. Create %s.",
+                             target_dir, host_dir)
+                continue
+            pull_pairs.append((target_dir, host_dir))
+        if not pull_pairs:
             return
-        logging.info("adb pull %s %s", target_dir, host_dir)
-        self._dut.adb.pull(target_dir, host_dir)
-
-    def _DiffSymbols(self, dump_path, lib_path):
-        """Checks if a library includes all symbols in a dump.
 
-        Args:
-            dump_path: The path to the dump file containing list of symbols.
-            lib_path: The path to the library.
-
-        Returns:
-            A list of strings, the global symbols that are in the dump but not
-            in the library.
-
-        Raises:
-            IOError if fails to load the dump.
-            elf_parser.ElfError if fails to load the library.
-        """
-        with open(dump_path, "r") as dump_file:
-            dump_symbols = set(line.strip() for line in dump_file
-                               if line.strip())
-        parser = elf_parser.ElfParser(lib_path)
+        target_dirs = {target_dir.strip("/") + "/": host_dir
+                       for target_dir, host_dir in pull_pairs}
+        tar_path = os.path.join(self._temp_dir, "lib_dirs.tar")
+        # exec-out doesn't separate stderr from stdout. Write the messages
+        # from tar and the exit status to a file on device to keep the stream
+        # intact.
+        tar_cmd = "tar -chf - -C / %s 2>%s; echo $? >>%s" % (
+            " ".join(sorted(target_dirs)), self._TAR_LOG_PATH,
+            self._TAR_LOG_PATH)
+        logging.info("adb exec-out %s", tar_cmd)
         try:
-            lib_symbols = parser.ListGlobalDynamicSymbols(include_weak=True)
+            # AdbProxy joins its arguments into one command and runs it with
+            # shell=True, so ">" redirects the stdout of adb on host. The
+            # stream is written to a file instead of being kept in memory.
+            result = self._dut.adb.exec_out(pipes.quote(tar_cmd), ">",
+                                            pipes.quote(tar_path),
+                                            no_except=True)
+            # Read and remove the log on device before checking the results.
+            log_cmd = "cat %s; rm -f %s" % (self._TAR_LOG_PATH,
+                                             self._TAR_LOG_PATH)
+            log_result = self._dut.adb.shell(pipes.quote(log_cmd),
+                                             no_except=True)
+            tar_log = log_result[const.STDOUT].splitlines()
+            asserts.assertEqual(result[const.EXIT_CODE], 0,
+                                "adb exec-out fails: " +
+                                result[const.STDERR])
+
+            try:
+                tar = tarfile.open(tar_path, "r|")
+            except tarfile.ReadError as e:
+                # The stream is empty if the device doesn't support tar -h.
+                logging.warning("Cannot read tar stream: %s", e)
+                for target_dir, host_dir in pull_pairs:
+                    os.rmdir(host_dir)
+                    logging.info("adb pull %s %s", target_dir, host_dir)
+                    self._dut.adb.pull(target_dir, host_dir)
+                return
+            # A file skipped by tar would be reported as not found on target.
+            asserts.assertEqual(tar_log, ["0"],
+                                "tar fails. Messages and exit status:\n" +
+                                "\n".join(tar_log))
+            for member in tar:
+                host_path = self._MapTarMemberName(member.name, target_dirs)
+                if not host_path:
+                    continue
+                if member.islnk():
+                    # tar -h stores the files with the same inode as hard
+                    # links to the first one.
+                    link_path = self._MapTarMemberName(member.linkname,
+                                                       target_dirs)
+                    if link_path and os.path.isfile(link_path):
+                        self._CreateParentDir(host_path)
+                        shutil.copy(link_path, host_path)
+                    continue
+                if not (member.isfile() or member.isdir()):
+                    continue
+                member.name = os.path.basename(host_path)
+                tar.extract(member, os.path.dirname(host_path))
+            tar.close()
         finally:
-            parser.Close()
-        return sorted(dump_symbols.difference(lib_symbols))
+            if os.path.exists(tar_path):
+                os.remove(tar_path)
 
-    def _DiffVtables(self, dump_path, lib_path):
-        """Checks if a library includes all vtable entries in a dump.
+    @staticmethod
+    def _MapTarMemberName(name, target_dirs):
+        """Maps a path in the tar stream from device to a path on host.
 
         Args:
-            dump_path: The path to the dump file containing vtables.
-            lib_path: The path to the library.
+            name: The path in the tar stream.
+            target_dirs: A dict of {target_dir: host_dir}. target_dir is a
+                         relative path ending with "/".
 
         Returns:
-            A list of tuples (VTABLE, SYMBOL, EXPECTED_OFFSET, ACTUAL_OFFSET).
-            ACTUAL_OFFSET can be "missing" or numbers separated by comma.
+            A string, the path on host.
+            None if the path is not in any target_dir.
+        """
+        prefix = next((x for x in target_dirs if
+                       (name + "/").startswith(x)), None)
+        if not prefix:
+            return None
+        rel_path = name[len(prefix):]
+        if (not rel_path or os.path.isabs(rel_path) or
+                os.pardir in rel_path.split("/")):
+            return None
+        return os.path.join(target_dirs[prefix], rel_path)
+
+    @staticmethod
+    def _CreateParentDir(path):
+        """Creates the parent directory of a path if it does not exist.
 
-        Raises:
-            IOError if fails to load the dump.
-            vtable_parser.VtableError if fails to load the library.
+        Args:
+            path: The path to a file.
         """
-        parser = vtable_parser.VtableParser(
-            os.path.join(self.data_file_path, "host"))
-        with open(dump_path, "r") as dump_file:
-            dump_vtables = parser.ParseVtablesFromString(dump_file.read())
-
-        lib_vtables = parser.ParseVtablesFromLibrary(lib_path)
-        # TODO(b/78316564): The dumper doesn't support SHT_ANDROID_RELA.
-        if not lib_vtables and self.run_as_compliance_test:
-            logging.warning("%s: Cannot dump vtables",
-                            os.path.relpath(lib_path, self._temp_dir))
-            return []
-        logging.debug("%s: %s", lib_path, lib_vtables)
-        diff = []
-        for vtable, dump_symbols in dump_vtables.iteritems():
-            lib_inv_vtable = dict()
-            if vtable in lib_vtables:
-                for off, sym in lib_vtables[vtable]:
-                    if sym not in lib_inv_vtable:
-                        lib_inv_vtable[sym] = [off]
-                    else:
-                        lib_inv_vtable[sym].append(off)
-            for off, sym in dump_symbols:
-                if sym not in lib_inv_vtable:
-                    diff.append((vtable, sym, str(off), "missing"))
-                elif off not in lib_inv_vtable[sym]:
-                    diff.append((vtable, sym, str(off),
-                                 ",".join(str(x) for x in lib_inv_vtable[sym])))
-        return diff
+        dir_name = os.path.dirname(path)
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name, 0750)
 
     def _ScanLibDirs(self, dump_dir, lib_dirs, dump_version):
         """Compares dump files with libraries copied from device.
@@ -186,65 +604,110 @@ class VtsVndkAbiTest(base_test.BaseTestClass):
         vtable_dumps = dict()
         lib_paths = dict()
         for dump_rel_path, dump_path in _IterateFiles(dump_dir):
-            if dump_rel_path.endswith("_symbol.dump"):
-                lib_name = dump_rel_path.rpartition("_symbol.dump")[0]
+            if dump_rel_path.endswith(_SYMBOL_DUMP_SUFFIX):
+                lib_name = dump_rel_path[:-len(_SYMBOL_DUMP_SUFFIX)]
                 symbol_dumps[lib_name] = dump_path
-            elif dump_rel_path.endswith("_vtable.dump"):
-                lib_name = dump_rel_path.rpartition("_vtable.dump")[0]
+            elif dump_rel_path.endswith(_VTABLE_DUMP_SUFFIX):
+                lib_name = dump_rel_path[:-len(_VTABLE_DUMP_SUFFIX)]
                 vtable_dumps[lib_name] = dump_path
             else:
                 logging.warning("Unknown dump: %s", dump_path)
                 continue
             lib_paths[lib_name] = None
 
+        vndk_dirs = [(x + os.path.sep, x + "-" + dump_version + os.path.sep)
+                     for x in ("vndk", "vndk-sp")]
         for lib_dir in lib_dirs:
             for lib_rel_path, lib_path in _IterateFiles(lib_dir):
-                try:
-                    vndk_dir = next(x for x in ("vndk", "vndk-sp") if
-                                    lib_rel_path.startswith(x + os.path.sep))
-                    lib_name = lib_rel_path.replace(
-                        vndk_dir, vndk_dir + "-" + dump_version, 1)
-                except StopIteration:
-                    lib_name = lib_rel_path
+                lib_name = lib_rel_path
+                for vndk_dir, versioned_vndk_dir in vndk_dirs:
+                    if lib_rel_path.startswith(vndk_dir):
+                        lib_name = (versioned_vndk_dir +
+                                    lib_rel_path[len(vndk_dir):])
+                        break
 
                 if lib_name in lib_paths and not lib_paths[lib_name]:
                     lib_paths[lib_name] = lib_path
 
-        for lib_name, lib_path in lib_paths.iteritems():
+        dumper_dir = os.path.join(self.data_file_path, "host")
+        tasks = []
+        for lib_name, lib_path in sorted(lib_paths.iteritems()):
             if not lib_path:
                 logging.info("%s: Not found on target", lib_name)
                 continue
-            rel_path = os.path.relpath(lib_path, self._temp_dir)
-
-            has_exception = False
-            missing_symbols = []
-            vtable_diff = []
-            # Compare symbols
-            if lib_name in symbol_dumps:
-                try:
-                    missing_symbols = self._DiffSymbols(
-                        symbol_dumps[lib_name], lib_path)
-                except (IOError, elf_parser.ElfError):
-                    logging.exception("%s: Cannot diff symbols", rel_path)
-                    has_exception = True
-            # Compare vtables
-            if lib_name in vtable_dumps:
+            tasks.append((lib_path,
+                          symbol_dumps.get(lib_name),
+                          vtable_dumps.get(lib_name),
+                          self.run_as_compliance_test))
+
+        # The libraries are independent of each other. Diff them in worker
+        # processes and log the results in order in this process.
+        now = time.time()
+        results = [None] * len(tasks)
+        cache_keys = [None] * len(tasks)
+        uncached_results = []
+        pool = None
+        try:
+            if self._diff_cache is not None and tasks:
+                # Reuse the results of the unchanged libraries and dumps.
+                dumper_path = os.path.join(
+                    dumper_dir, "bin",
+                    vtable_parser.VtableParser.VNDK_VTABLE_DUMPER)
                 try:
-                    vtable_diff = self._DiffVtables(
-                        vtable_dumps[lib_name], lib_path)
-                except (IOError, vtable_parser.VtableError):
-                    logging.exception("%s: Cannot diff vtables", rel_path)
-                    has_exception = True
+                    dumper_hash = _HashFile(dumper_path)
+                except EnvironmentError:
+                    dumper_hash = None
+                pool = multiprocessing.Pool(initializer=_InitWorker,
+                                            initargs=(dumper_dir,))
+                cache_keys = pool.map(_GetDiffCacheKey,
+                                      [(task, dumper_hash) for task in tasks])
+                for index, cache_key in enumerate(cache_keys):
+                    entry = self._diff_cache.get(cache_key)
+                    if entry:
+                        entry["time"] = now
+                        results[index] = tuple(entry["result"]) + ([],)
+            uncached = [index for index, result in enumerate(results)
+                        if result is None]
+            logging.info("Diff %d libraries. %d results are cached.",
+                         len(tasks), len(tasks) - len(uncached))
+
+            if uncached:
+                if not pool:
+                    pool = multiprocessing.Pool(initializer=_InitWorker,
+                                                initargs=(dumper_dir,))
+                uncached_results = pool.map(_DiffLibraryInWorker,
+                                            [tasks[x] for x in uncached])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        for index, result in zip(uncached, uncached_results):
+            results[index] = result
+            missing_symbols, vtable_diff, errors = result
+            if cache_keys[index] and not errors:
+                self._diff_cache[cache_keys[index]] = {
+                    "time": now,
+                    "result": [missing_symbols, vtable_diff]}
+
+        for task, result in zip(tasks, results):
+            lib_path = task[0]
+            missing_symbols, vtable_diff, errors = result
+            rel_path = os.path.relpath(lib_path, self._temp_dir)
 
+            for error in errors:
+                logging.error("%s: %s", rel_path, error)
+            if vtable_diff is None:
+                logging.warning("%s: Cannot dump vtables", rel_path)
+                vtable_diff = []
             if missing_symbols:
                 logging.error("%s: Missing Symbols:\n%s",
                               rel_path, "\n".join(missing_symbols))
             if vtable_diff:
                 logging.error("%s: Vtable Difference:\n"
                               "vtable symbol expected actual\n%s",
-                              rel_path,
-                              "\n".join(" ".join(x) for x in vtable_diff))
-            if has_exception or missing_symbols or vtable_diff:
+                              rel_path, _FormatVtableDiff(vtable_diff))
+            if errors or missing_symbols or vtable_diff:
                 error_count += 1
             else:
                 logging.info("%s: Pass", rel_path)
@@ -281,15 +744,13 @@ class VtsVndkAbiTest(base_test.BaseTestClass):
             self._temp_dir, "system_lib_dir_" + self.abi_bitness)
         logging.info("host lib dir: %s %s %s",
                      odm_lib_dir, vendor_lib_dir, system_lib_dir)
-        self._PullOrCreateDir(
-            getattr(self, "_ODM_LIB_DIR_" + self.abi_bitness),
-            odm_lib_dir)
-        self._PullOrCreateDir(
-            getattr(self, "_VENDOR_LIB_DIR_" + self.abi_bitness),
-            vendor_lib_dir)
-        self._PullOrCreateDir(
-            getattr(self, "_SYSTEM_LIB_DIR_" + self.abi_bitness),
-            system_lib_dir)
+        self._PullLibDirs([
+            (getattr(self, "_ODM_LIB_DIR_" + self.abi_bitness),
+             odm_lib_dir),
+            (getattr(self, "_VENDOR_LIB_DIR_" + self.abi_bitness),
+             vendor_lib_dir),
+            (getattr(self, "_SYSTEM_LIB_DIR_" + self.abi_bitness),
+             system_lib_dir)])
 
         error_count = self._ScanLibDirs(
             dump_dir, [odm_lib_dir, vendor_lib_dir, system_lib_dir], dump_version)
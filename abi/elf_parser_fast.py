@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2018 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mmap
+import struct
+
+# e_ident
+_ELF_MAGIC = "\x7fELF"
+_EI_CLASS = 4
+_EI_DATA = 5
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+# Section types and indexes
+_SHT_DYNSYM = 11
+_SHN_UNDEF = 0
+
+# Symbol bindings
+_STB_GLOBAL = 1
+_STB_WEAK = 2
+
+# The formats of the ELF structures without byte order.
+# (e_shoff, e_shentsize, e_shnum) and their offset in the header.
+_SECTION_INFO_32 = ("I10xHH", 0x20)
+_SECTION_INFO_64 = ("Q10xHH", 0x28)
+# (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info,
+#  sh_addralign, sh_entsize)
+_SECTION_HEADER_32 = "IIIIIIIIII"
+_SECTION_HEADER_64 = "IIQQQQIIQQ"
+# (st_name, st_info, st_shndx)
+_SYMBOL_32 = "I8xBxH"
+_SYMBOL_64 = "IBxH16x"
+
+
+class ElfError(Exception):
+    """The exception raised by ElfParser."""
+    pass
+
+
+class ElfParser(object):
+    """A parser which finds dynamic symbols in a memory-mapped ELF file.
+
+    This class replaces vts.utils.python.library.elf_parser in the ABI test,
+    which only checks whether a library defines the symbols in a dump. The
+    structures are unpacked directly from the mapped file, so only the ELF
+    header, the section headers, .dynsym, and the referenced strings in
+    .dynstr are read.
+
+    Attributes:
+        _file: The file object of the ELF.
+        _mmap: The memory-mapped content of the file.
+        _prefix: The byte order character for struct formats.
+        _is_64: A boolean, whether the ELF class is 64-bit.
+        _sections: A list of section header tuples.
+    """
+
+    def __init__(self, file_path):
+        """Opens and maps an ELF file and loads the section headers.
+
+        Args:
+            file_path: The path to the ELF file.
+
+        Raises:
+            ElfError if the file cannot be opened or is not a valid ELF.
+        """
+        self._file = None
+        self._mmap = None
+        try:
+            self._file = open(file_path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self._LoadSectionHeaders()
+        except (EnvironmentError, ValueError, struct.error, ElfError) as e:
+            self.Close()
+            raise ElfError("%s: %s" % (file_path, e))
+
+    def Close(self):
+        """Unmaps and closes the ELF file."""
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _LoadSectionHeaders(self):
+        """Loads the byte order, the class, and the section headers.
+
+        Raises:
+            ElfError if the ELF header is invalid.
+            struct.error if the file is truncated.
+        """
+        ident = self._mmap[:16]
+        if not ident.startswith(_ELF_MAGIC):
+            raise ElfError("Not an ELF file.")
+
+        elf_data = ord(ident[_EI_DATA])
+        if elf_data == _ELFDATA2LSB:
+            self._prefix = "<"
+        elif elf_data == _ELFDATA2MSB:
+            self._prefix = ">"
+        else:
+            raise ElfError("Unknown byte order %d." % elf_data)
+
+        elf_class = ord(ident[_EI_CLASS])
+        if elf_class not in (_ELFCLASS32, _ELFCLASS64):
+            raise ElfError("Unknown class %d." % elf_class)
+        self._is_64 = (elf_class == _ELFCLASS64)
+
+        info_format, info_offset = (_SECTION_INFO_64 if self._is_64 else
+                                    _SECTION_INFO_32)
+        shoff, shentsize, shnum = struct.unpack_from(
+            self._prefix + info_format, self._mmap, info_offset)
+        header = struct.Struct(self._prefix + (_SECTION_HEADER_64 if
+                                               self._is_64 else
+                                               _SECTION_HEADER_32))
+        if not shoff:
+            self._sections = []
+            return
+        if shentsize < header.size:
+            raise ElfError("Invalid section header size %d." % shentsize)
+        if shnum == 0:
+            # The number of sections is in sh_size of the first section.
+            shnum = header.unpack_from(self._mmap, shoff)[5]
+        self._sections = [header.unpack_from(self._mmap, shoff + x * shentsize)
+                          for x in xrange(shnum)]
+
+    def MatchGlobalDynamicSymbols(self, wanted, include_weak=False):
+        """Finds the global symbols defined in .dynsym among given names.
+
+        The list of all names is not built. Each name is sliced from the
+        mapped string table and kept only if it is wanted.
+
+        Args:
+            wanted: A set of strings, the names to find.
+            include_weak: A boolean, whether to include weak symbols.
+
+        Returns:
+            A set of strings, the names in wanted that are defined.
+
+        Raises:
+            ElfError if .dynsym or its string table is not found or invalid.
+        """
+        dynsym = next((x for x in self._sections if x[1] == _SHT_DYNSYM),
+                      None)
+        if not dynsym:
+            raise ElfError("Cannot find .dynsym.")
+        sh_offset, sh_size, sh_link, sh_entsize = (
+            dynsym[4], dynsym[5], dynsym[6], dynsym[9])
+        if sh_link >= len(self._sections):
+            raise ElfError("Invalid .dynsym link %d." % sh_link)
+        dynstr = self._sections[sh_link]
+
+        symbol = struct.Struct(self._prefix + (_SYMBOL_64 if self._is_64 else
+                                               _SYMBOL_32))
+        if sh_entsize < symbol.size:
+            raise ElfError("Invalid symbol size %d." % sh_entsize)
+        if sh_offset + sh_size > len(self._mmap):
+            raise ElfError(".dynsym is out of the file.")
+
+        bindings = ((_STB_GLOBAL, _STB_WEAK) if include_weak else
+                    (_STB_GLOBAL,))
+        unpack_from = symbol.unpack_from
+        elf_mmap = self._mmap
+        find = elf_mmap.find
+        strtab_begin = dynstr[4]
+        strtab_end = dynstr[4] + dynstr[5]
+        found = set()
+        # Skip the first symbol which is always undefined. If sh_size is not
+        # a multiple of sh_entsize, ignore the incomplete last entry.
+        for offset in xrange(sh_offset + sh_entsize,
+                             sh_offset + sh_size - symbol.size + 1,
+                             sh_entsize):
+            st_name, st_info, st_shndx = unpack_from(elf_mmap, offset)
+            if st_shndx == _SHN_UNDEF or (st_info >> 4) not in bindings:
+                continue
+            begin = strtab_begin + st_name
+            null = find("\0", begin, strtab_end)
+            if null < 0:
+                raise ElfError("Invalid string offset %d." % st_name)
+            name = elf_mmap[begin:null]
+            if name in wanted:
+                found.add(name)
+        return found